@@ -7,14 +7,77 @@ and exports them to a CSV file.
 """
 
 import argparse
+import copy
 import csv
+import importlib.util
 import json
 import os
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
 
 import pymongo
 import requests
+from bson.codec_options import CodecOptions
+
+import csv_formatter
+
+# Number of users fetched per cursor round-trip and written per batch
+BATCH_SIZE = 1000
+
+# Wire compressors in order of preference, with the module pymongo needs
+# for each; only those whose module is installed are requested
+COMPRESSOR_MODULES = (
+    ("zstd", "zstandard"),
+    ("snappy", "snappy")
+)
+
+# MongoDB client options tuned for a few long bulk reads: keep the pool small
+# since the script issues queries sequentially
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 4,
+    "socketTimeoutMS": 120000
+}
+
+# Decode users into plain dicts with naive UTC datetimes, regardless of the
+# options set on the client, so exported dates keep a stable format
+USER_CODEC_OPTIONS = CodecOptions(document_class=dict, tz_aware=False)
+
+# Config keys that must be present as non-empty strings
+REQUIRED_CONFIG_KEYS = (
+    "mongo_uri",
+    "mongo_db",
+    "mongo_collection",
+    "email_field",
+    "name_field",
+    "created_at_field",
+    "processed_csv_path",
+    "tracking_collection",
+    "last_sync_key"
+)
+
+# Parsed config files keyed by absolute path, with the modification time they
+# were parsed at, so repeated loads in one process skip re-parsing
+_CONFIG_CACHE = {}
+
+def clear_config_cache():
+    """Forget all cached config files."""
+    _CONFIG_CACHE.clear()
+
+def available_compressors():
+    """Return the preferred wire compressors that can be used here."""
+    return [
+        compressor
+        for compressor, module in COMPRESSOR_MODULES
+        if importlib.util.find_spec(module) is not None
+    ]
+
+def to_text(value):
+    """Convert a document value to text the way csv.writer would."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return str(value)
 
 class MongoToListmonk:
     """MongoDB to ListMonk integration class."""
@@ -23,134 +86,385 @@ class MongoToListmonk:
         """Initialize with the given configuration file."""
         self.config_file = config_file
         self.config = self.load_config()
+        self._validate_config()
+        self.last_exported = None
         
     def load_config(self):
-        """Load configuration from the config file."""
+        """
+        Load configuration from the config file.
+        
+        The parsed config is cached and reused until the file's modification
+        time changes. Each call returns its own copy, so changes made through
+        one instance never reach the cache or other instances.
+        """
         try:
-            with open(self.config_file, 'r') as f:
-                return json.load(f)
+            path = os.path.abspath(self.config_file)
+            mtime = os.stat(path).st_mtime_ns
+            
+            cached = _CONFIG_CACHE.get(path)
+            if cached and cached[0] == mtime:
+                return copy.deepcopy(cached[1])
+            
+            with open(path, 'r') as f:
+                config = json.load(f)
+            
+            _CONFIG_CACHE[path] = (mtime, config)
+            return copy.deepcopy(config)
         except Exception as e:
             print(f"Error loading config: {e}")
             sys.exit(1)
     
+    def _validate_config(self):
+        """Check that all required config keys are present and well-typed."""
+        config = self.config
+        required = list(REQUIRED_CONFIG_KEYS)
+        if config.get("keep_raw_csv", False):
+            required.append("raw_csv_path")
+        
+        errors = [
+            f"{key} must be a non-empty string"
+            for key in required
+            if not isinstance(config.get(key), str) or not config[key]
+        ]
+        
+        batch_limit = config.get("batch_limit", 0)
+        if isinstance(batch_limit, bool) or not isinstance(batch_limit, int) or batch_limit < 0:
+            errors.append("batch_limit must be a non-negative integer")
+        
+        if not isinstance(config.get("keep_raw_csv", False), bool):
+            errors.append("keep_raw_csv must be true or false")
+        
+        if errors:
+            print(f"Error in config {self.config_file}: {'; '.join(errors)}")
+            sys.exit(1)
+    
     def connect_to_mongo(self):
         """Connect to MongoDB and return the database object."""
         try:
-            client = pymongo.MongoClient(self.config["mongo_uri"])
+            # Compress wire traffic where the server and installed libraries
+            # allow it; pymongo warns about compressors it cannot load
+            options = dict(MONGO_CLIENT_OPTIONS)
+            compressors = available_compressors()
+            if compressors:
+                options["compressors"] = ",".join(compressors)
+            
+            client = pymongo.MongoClient(self.config["mongo_uri"], **options)
             db = client[self.config["mongo_db"]]
             return db
         except Exception as e:
             print(f"Error connecting to MongoDB: {e}")
             return None
     
-    def get_last_sync_timestamp(self, db):
-        """Get the timestamp of the last successful sync."""
-        try:
-            tracking_collection = db[self.config["tracking_collection"]]
-            last_sync = tracking_collection.find_one({"_id": self.config["last_sync_key"]})
-            
-            if last_sync:
-                return last_sync.get("timestamp")
-            return None
-        except Exception as e:
-            print(f"Error getting last sync timestamp: {e}")
-            return None
+    def get_last_sync_position(self, db):
+        """
+        Get the position of the last successful sync.
+        
+        Returns a (timestamp, last_id) tuple identifying the last imported
+        user in (created_at, _id) order. Either value may be None if no sync
+        has been recorded yet or it predates _id tracking.
+        """
+        tracking_collection = db[self.config["tracking_collection"]]
+        last_sync = tracking_collection.find_one({"_id": self.config["last_sync_key"]})
+        
+        if last_sync:
+            return last_sync.get("timestamp"), last_sync.get("last_id")
+        return None, None
+    
+    def save_pending_sync_position(self, db):
+        """
+        Record the position of the last exported user as pending.
+        
+        The pending position becomes the last sync position once
+        update_last_sync_timestamp() confirms the import.
+        """
+        tracking_collection = db[self.config["tracking_collection"]]
+        timestamp, last_id = self.last_exported
+        
+        tracking_collection.update_one(
+            {"_id": self.config["last_sync_key"]},
+            {"$set": {"pending_timestamp": timestamp, "pending_last_id": last_id}},
+            upsert=True
+        )
     
     def update_last_sync_timestamp(self, db):
-        """Update the timestamp of the last successful sync."""
-        try:
-            tracking_collection = db[self.config["tracking_collection"]]
-            current_time = datetime.utcnow()
-            
-            tracking_collection.update_one(
-                {"_id": self.config["last_sync_key"]},
-                {"$set": {"timestamp": current_time}},
-                upsert=True
+        """
+        Update the position of the last successful sync.
+        
+        Promotes the pending position saved by the extraction run, falling
+        back to the current time if no extraction is pending.
+        """
+        tracking_collection = db[self.config["tracking_collection"]]
+        last_sync = tracking_collection.find_one({"_id": self.config["last_sync_key"]}) or {}
+        
+        if "pending_last_id" in last_sync:
+            update = {
+                "$set": {
+                    "timestamp": last_sync.get("pending_timestamp"),
+                    "last_id": last_sync["pending_last_id"]
+                },
+                "$unset": {"pending_timestamp": "", "pending_last_id": ""}
+            }
+        else:
+            update = {
+                "$set": {"timestamp": datetime.now(timezone.utc)},
+                "$unset": {"last_id": ""}
+            }
+        
+        tracking_collection.update_one(
+            {"_id": self.config["last_sync_key"]},
+            update,
+            upsert=True
+        )
+    
+    def _preflight(self, db):
+        """
+        Check that the user collection is indexed for incremental syncs.
+        
+        Raises RuntimeError if no index starts with the created_at field,
+        since every extraction would then scan and sort the whole collection.
+        Returns the key of a (created_at, _id) index in either direction, or
+        None with a warning if only a created_at index is available.
+        """
+        created_at_field = self.config["created_at_field"]
+        keys = [(created_at_field, 1), ("_id", 1)]
+        indexes = db[self.config["mongo_collection"]].index_information().values()
+        
+        if not any(index["key"][0][0] == created_at_field for index in indexes):
+            raise RuntimeError(
+                f"Collection {self.config['mongo_collection']} has no index on "
+                f"{created_at_field}; create one with {dict(keys)}"
             )
-            
-            return True
-        except Exception as e:
-            print(f"Error updating last sync timestamp: {e}")
-            return False
+        
+        # An index scanned backwards serves the sort just as well, as long as
+        # both keys run in the same direction
+        for direction in (1, -1):
+            sync_keys = [(created_at_field, direction), ("_id", direction)]
+            for index in indexes:
+                if list(index["key"]) == sync_keys:
+                    return sync_keys
+        
+        print(
+            f"Warning: no index on {dict(keys)} in collection "
+            f"{self.config['mongo_collection']}; the server will sort all matching "
+            f"users in memory, which on a first run is the whole collection and "
+            f"may exceed the sort memory limit"
+        )
+        return None
     
     def extract_new_users(self, db):
-        """Extract new users from MongoDB since the last sync."""
+        """
+        Extract new users from MongoDB since the last sync.
+        
+        Users are returned in (created_at, _id) order, capped at the
+        configured batch_limit, so an interrupted or partial sync resumes
+        exactly where the previous one stopped. Returns a cursor over the
+        matching users so they can be streamed to disk.
+        """
+        sync_index = self._preflight(db)
+        
+        # Users may be read from a secondary; the tracking collection stays on
+        # the primary so a pending sync position is always read back
+        collection = db[self.config["mongo_collection"]].with_options(
+            codec_options=USER_CODEC_OPTIONS,
+            read_preference=pymongo.ReadPreference.SECONDARY_PREFERRED
+        )
+        created_at_field = self.config["created_at_field"]
+        last_sync, last_id = self.get_last_sync_position(db)
+        
+        query = {}
+        if last_id is not None:
+            # Users sharing the last synced timestamp are told apart by _id.
+            # Users without a timestamp sort first, so a position without
+            # one is followed by every user that has a timestamp.
+            newer = {"$gt": last_sync} if last_sync is not None else {"$ne": None}
+            query = {"$or": [
+                {created_at_field: newer},
+                {created_at_field: last_sync, "_id": {"$gt": last_id}}
+            ]}
+        elif last_sync:
+            query = {created_at_field: {"$gt": last_sync}}
+        
+        # Get only the fields we need; _id is kept for the sync position
+        projection = {
+            self.config["email_field"]: 1,
+            self.config["name_field"]: 1,
+            created_at_field: 1,
+            "_id": 1
+        }
+        
+        sort = [(created_at_field, 1), ("_id", 1)]
+        cursor = (
+            collection.find(query, projection, batch_size=BATCH_SIZE)
+            .sort(sort)
+            .limit(self.config.get("batch_limit", 0))
+        )
+        
+        # Make sure the $or branches use the sync index
+        if sync_index:
+            cursor = cursor.hint(sync_index)
+        
+        return cursor
+    
+    def _export(self, path, users, begin, format_user, **open_args):
+        """
+        Stream users into a new file at path.
+        
+        begin(f) writes any header and returns the function that writes a
+        batch of rows; format_user(user) returns the row for a user, or None
+        to skip it. Users are consumed from the given iterable as they are
+        written, so a MongoDB cursor is never held in memory as a whole, and
+        the (created_at, _id) position of the last user read is kept in
+        last_exported.
+        
+        Returns a (read, written) tuple of user counts, or None if the file
+        cannot be opened.
+        """
+        created_at_field = self.config["created_at_field"]
+        
         try:
-            collection = db[self.config["mongo_collection"]]
-            last_sync = self.get_last_sync_timestamp(db)
+            # Create temp directory if it doesn't exist
+            os.makedirs(os.path.dirname(path), exist_ok=True)
             
-            query = {}
-            if last_sync:
-                query = {self.config["created_at_field"]: {"$gt": last_sync}}
+            f = open(path, buffering=csv_formatter.BUFFER_SIZE, **open_args)
+        except OSError as e:
+            print(f"Error exporting to CSV: {e}")
+            return None
+        
+        with f:
+            write_batch = begin(f)
             
-            # Get all fields we need
-            projection = {
-                self.config["email_field"]: 1,
-                self.config["name_field"]: 1,
-                self.config["created_at_field"]: 1
-            }
+            # read tracks the cursor position, written the rows actually
+            # exported
+            read = 0
+            written = 0
+            batch = []
+            for user in users:
+                read += 1
+                row = format_user(user)
+                if row is None:
+                    continue
+                
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    write_batch(batch)
+                    written += len(batch)
+                    batch.clear()
             
-            users = list(collection.find(query, projection))
-            print(f"Found {len(users)} new users since last sync")
+            write_batch(batch)
+            written += len(batch)
             
-            return users
-        except Exception as e:
-            print(f"Error extracting users: {e}")
-            return []
+            if read:
+                self.last_exported = (user.get(created_at_field), user.get("_id"))
+        
+        return read, written
     
     def export_to_csv(self, users):
-        """Export users to a CSV file."""
-        try:
-            # Create temp directory if it doesn't exist
-            os.makedirs(os.path.dirname(self.config["raw_csv_path"]), exist_ok=True)
-            
-            with open(self.config["raw_csv_path"], 'w', newline='') as f:
-                # Define CSV fields
-                fieldnames = [
-                    self.config["email_field"],
-                    self.config["name_field"],
-                    self.config["created_at_field"]
-                ]
-                
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                
-                # Write user data
-                for user in users:
-                    row = {
-                        self.config["email_field"]: user.get(self.config["email_field"], ""),
-                        self.config["name_field"]: user.get(self.config["name_field"], ""),
-                        self.config["created_at_field"]: user.get(self.config["created_at_field"], "")
-                    }
-                    writer.writerow(row)
-            
-            print(f"Exported {len(users)} users to {self.config['raw_csv_path']}")
-            return True
-        except Exception as e:
-            print(f"Error exporting to CSV: {e}")
-            return False
+        """
+        Export users to the raw CSV file, one column per exported field.
+        
+        Returns a (read, written) tuple of user counts, or None if the file
+        cannot be opened.
+        """
+        # Look up the field names once rather than on every row
+        email_field = self.config["email_field"]
+        name_field = self.config["name_field"]
+        created_at_field = self.config["created_at_field"]
+        
+        def begin(f):
+            writer = csv.writer(f)
+            writer.writerow((email_field, name_field, created_at_field))
+            return writer.writerows
+        
+        def format_user(user):
+            return (
+                user.get(email_field, ""),
+                user.get(name_field, ""),
+                user.get(created_at_field, "")
+            )
+        
+        return self._export(
+            self.config["raw_csv_path"], users, begin, format_user, mode='w', newline=''
+        )
     
-    def format_csv(self):
-        """Format the raw CSV file for ListMonk."""
-        try:
-            # Import the CSV formatter module
-            sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-            import csv_formatter
+    def export_for_listmonk(self, users):
+        """
+        Format users for ListMonk and write them to the processed CSV file.
+        
+        This skips the raw CSV file, formatting each user as it is read from
+        the cursor; users without an email are skipped. Returns a (read,
+        written) tuple of user counts, or None if the file cannot be opened.
+        """
+        email_field = self.config["email_field"]
+        name_field = self.config["name_field"]
+        created_at_field = self.config["created_at_field"]
+        format_row = csv_formatter.format_row
+        
+        # Batches are encoded as a whole, so write them in binary mode
+        def begin(f):
+            f.write(csv_formatter.HEADER.encode('utf-8'))
+            return lambda batch: f.write(''.join(batch).encode('utf-8'))
+        
+        def format_user(user):
+            # Check the email before converting any other field
+            email = user.get(email_field)
+            if not email:
+                return None
             
-            # Process the CSV file
-            result = csv_formatter.process_csv(
-                self.config["raw_csv_path"],
-                self.config["processed_csv_path"]
+            return format_row(
+                to_text(email),
+                to_text(user.get(name_field)),
+                to_text(user.get(created_at_field))
             )
-            
-            return result
-        except Exception as e:
-            print(f"Error formatting CSV: {e}")
-            return False
+        
+        return self._export(
+            self.config["processed_csv_path"], users, begin, format_user, mode='wb'
+        )
+    
+    def format_csv(self):
+        """
+        Format the raw CSV file for ListMonk.
+        
+        Returns the number of users written, or None on failure.
+        """
+        return csv_formatter.process_csv(
+            self.config["raw_csv_path"],
+            self.config["processed_csv_path"]
+        )
+    
+    def export_users(self, users):
+        """
+        Export users to the processed CSV file ready for ListMonk.
+        
+        With keep_raw_csv enabled, users are written to the raw CSV file first
+        and then formatted from it, which leaves the raw export around for
+        debugging. Either way, the number of users written to the processed
+        file is reported, which leaves out users without an email.
+        
+        Returns the number of users read, or None on failure.
+        """
+        keep_raw_csv = self.config.get("keep_raw_csv", False)
+        if keep_raw_csv:
+            result = self.export_to_csv(users)
+        else:
+            result = self.export_for_listmonk(users)
+        if result is None:
+            return None
+        
+        count, written = result
+        print(f"Found {count} new users since last sync")
+        
+        if keep_raw_csv and count:
+            written = self.format_csv()
+            if written is None:
+                return None
+        
+        print(f"Exported {written} users to {self.config['processed_csv_path']}")
+        return count
     
     def run(self, skip_timestamp_update=False):
         """Run the integration process."""
-        print(f"Starting MongoDB to ListMonk integration at {datetime.now()}")
+        started_at = datetime.now().isoformat(sep=' ', timespec='seconds')
+        print(f"Starting MongoDB to ListMonk integration at {started_at}")
         
         # Connect to MongoDB
         db = self.connect_to_mongo()
@@ -159,21 +473,21 @@ class MongoToListmonk:
         
         # Extract new users
         users = self.extract_new_users(db)
-        if not users:
-            print("No new users found")
-            return True
         
-        # Export users to CSV
-        if not self.export_to_csv(users):
+        # Export users to CSV formatted for ListMonk
+        count = self.export_users(users)
+        if count is None:
             return False
+        if count == 0:
+            print("No new users found")
+            return True
         
-        # Format CSV for ListMonk
-        if not self.format_csv():
-            return False
+        # Remember where this export stopped
+        self.save_pending_sync_position(db)
         
         # Update last sync timestamp
-        if not skip_timestamp_update and not self.update_last_sync_timestamp(db):
-            return False
+        if not skip_timestamp_update:
+            self.update_last_sync_timestamp(db)
         
         print("MongoDB to ListMonk integration completed successfully")
         return True
@@ -188,39 +502,43 @@ def main():
     
     integration = MongoToListmonk(args.config)
     
-    if args.update_timestamp:
-        # Only update the timestamp
-        db = integration.connect_to_mongo()
-        if db is None:
-            sys.exit(1)
-        success = integration.update_last_sync_timestamp(db)
-        sys.exit(0 if success else 1)
-    elif args.extract_only:
-        # Only extract and format users
-        db = integration.connect_to_mongo()
-        if db is None:
-            sys.exit(1)
-        
-        # Extract new users
-        users = integration.extract_new_users(db)
-        if not users:
-            print("No new users found")
+    try:
+        if args.update_timestamp:
+            # Only update the timestamp
+            db = integration.connect_to_mongo()
+            if db is None:
+                sys.exit(1)
+            integration.update_last_sync_timestamp(db)
             sys.exit(0)
-        
-        # Export users to CSV
-        if not integration.export_to_csv(users):
-            sys.exit(1)
-        
-        # Format CSV for ListMonk
-        if not integration.format_csv():
-            sys.exit(1)
-        
-        print("Successfully extracted and formatted users")
-        sys.exit(0)
-    else:
-        # Run the full process except updating timestamp
-        success = integration.run(skip_timestamp_update=True)
-        sys.exit(0 if success else 1)
+        elif args.extract_only:
+            # Only extract and format users
+            db = integration.connect_to_mongo()
+            if db is None:
+                sys.exit(1)
+            
+            # Extract new users
+            users = integration.extract_new_users(db)
+            
+            # Export users to CSV formatted for ListMonk
+            count = integration.export_users(users)
+            if count is None:
+                sys.exit(1)
+            if count == 0:
+                print("No new users found")
+                sys.exit(0)
+            
+            # Remember where this export stopped
+            integration.save_pending_sync_position(db)
+            
+            print("Successfully extracted and formatted users")
+            sys.exit(0)
+        else:
+            # Run the full process except updating timestamp
+            success = integration.run(skip_timestamp_update=True)
+            sys.exit(0 if success else 1)
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -58,12 +58,28 @@ EXTRACT_OUTPUT=$(python3 "${SCRIPT_DIR}/mongo_to_listmonk.py" --config "${CONFIG
 EXTRACT_STATUS=$?
 echo "${EXTRACT_OUTPUT}" | tee -a "${LOG_FILE}"
 
+# Abort if the extraction failed (bad config, missing index, query error)
+if [ "${EXTRACT_STATUS}" -ne 0 ]; then
+    ERROR_MSG="Error: Extraction from MongoDB failed (exit status ${EXTRACT_STATUS}). Aborting import."
+    log "${ERROR_MSG}"
+    send_telegram_notification "❌ <b>ListMonk Import Failed</b>
+${ERROR_MSG}
+Time: $(date +"%Y-%m-%d %H:%M:%S")"
+    exit 1
+fi
+
 # Get the number of users extracted
 USER_COUNT=$(echo "${EXTRACT_OUTPUT}" | grep -o "Found [0-9]* new users" | awk '{print $2}')
 if [ -z "${USER_COUNT}" ]; then
     USER_COUNT=0
 fi
 
+# Get the number of users written to the import file (users without an email are skipped)
+EXPORTED_COUNT=$(echo "${EXTRACT_OUTPUT}" | grep -o "Exported [0-9]* users" | awk '{print $2}')
+if [ -z "${EXPORTED_COUNT}" ]; then
+    EXPORTED_COUNT=0
+fi
+
 # Check if CSV was created successfully
 if [ ! -f "${TEMP_DIR}/listmonk_import.csv" ] && [ "${USER_COUNT}" -gt 0 ]; then
     ERROR_MSG="Error: CSV file was not created. Aborting import."
@@ -83,6 +99,18 @@ Time: $(date +"%Y-%m-%d %H:%M:%S")"
     exit 0
 fi
 
+# If none of the new users has an email, there is nothing to upload; move the
+# sync position past them so they are not extracted again
+if [ "${EXPORTED_COUNT}" -eq 0 ]; then
+    log "None of the ${USER_COUNT} new users has an email. Skipping upload."
+    log "Updating last sync timestamp"
+    python3 "${SCRIPT_DIR}/mongo_to_listmonk.py" --config "${CONFIG_FILE}" --update-timestamp > >(tee -a "${LOG_FILE}") 2>&1
+    send_telegram_notification "ℹ️ <b>ListMonk Import Summary</b>
+Found ${USER_COUNT} new users, none with an email address. Nothing to import.
+Time: $(date +"%Y-%m-%d %H:%M:%S")"
+    exit 0
+fi
+
 # Import the CSV into ListMonk using curl
 log "Importing users into ListMonk"
 
@@ -141,7 +169,7 @@ else
     
     # Send success notification
     send_telegram_notification "✅ <b>ListMonk Import Successful</b>
-Successfully imported ${USER_COUNT} new users to \"${LISTMONK_LIST_NAME}\"
+Successfully imported ${EXPORTED_COUNT} new users to \"${LISTMONK_LIST_NAME}\"
 Time: $(date +"%Y-%m-%d %H:%M:%S")"
 fi
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for the CSV formatter.
+
+Run with: python -m unittest test_csv_formatter
+"""
+
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import csv_formatter
+
+# A stray quote inside an unquoted field followed by a quoted field spanning
+# two lines; the quote must not shift where records are split
+STRAY_QUOTE_INPUT = (
+    'email,name,createdAt\n'
+    'a"b@x.com,Ann Lee,2024\n'
+    'c@x.com,"Bob\nSmith, Jr",2024\n'
+    'd@x.com,Dee,2024\n'
+)
+
+def reference_row(email, name, created_at):
+    """Format a user with json and csv.writer, as format_row() replaces."""
+    email = email.strip()
+    if not email:
+        return None
+
+    name = name.strip()
+    created_at = created_at.strip()
+
+    attributes = {}
+    if name:
+        attributes['firstName'] = name.split()[0]
+        attributes['fullName'] = name
+    if created_at:
+        attributes['createdAt'] = created_at
+
+    out = io.StringIO()
+    writer = csv.writer(out, quoting=csv.QUOTE_MINIMAL)
+    writer.writerow([email, name, json.dumps(attributes, separators=(',', ':')), 'confirmed'])
+    return out.getvalue()
+
+class FormatRowTest(unittest.TestCase):
+    """Tests for format_row()."""
+
+    CASES = [
+        ('comma', 'a@x.com', 'Smith, John', '2024-01-01'),
+        ('quote', 'a@x.com', 'Jo "JJ" Lee', '2024-01-01'),
+        ('carriage return', 'a@x.com', 'Ann\rLee', '2024-01-01'),
+        ('newline', 'a@x.com', 'Ann\nLee', '2024-01-01'),
+        ('non-ASCII', 'a@x.com', '\u00c9lodie \u00dcn\u00efcode \U0001f600', '2024-01-01'),
+        ('empty name', 'a@x.com', '', '2024-01-01'),
+        ('only createdAt', 'a@x.com', '  ', '2024-01-01 10:00:00.123000'),
+        ('all fields empty', 'a@x.com', '', ''),
+        ('quoted email', 'a"b,c@x.com', 'Ann', ''),
+        ('surrounding whitespace', '  a@x.com ', ' Ann\tLee ', ' 2024 ')
+    ]
+
+    def test_matches_csv_writer(self):
+        for label, email, name, created_at in self.CASES:
+            with self.subTest(label):
+                self.assertEqual(
+                    csv_formatter.format_row(email, name, created_at),
+                    reference_row(email, name, created_at)
+                )
+
+    def test_all_fields_empty_attributes(self):
+        self.assertEqual(csv_formatter.format_row('a@x.com', '', ''), 'a@x.com,,{},confirmed\r\n')
+
+    def test_missing_email(self):
+        self.assertIsNone(csv_formatter.format_row('  ', 'Ann', '2024'))
+
+class ProcessCsvTest(unittest.TestCase):
+    """Tests for process_csv()."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.input_file = os.path.join(self.tmpdir.name, 'input.csv')
+        self.output_file = os.path.join(self.tmpdir.name, 'output.csv')
+
+        with open(self.input_file, 'w', encoding='utf-8', newline='') as f:
+            f.write(STRAY_QUOTE_INPUT)
+
+    def read_output(self):
+        with open(self.output_file, 'r', encoding='utf-8', newline='') as f:
+            return list(csv.reader(f))
+
+    def assert_stray_quote_output(self):
+        rows = self.read_output()
+
+        self.assertEqual(rows[0], ['email', 'name', 'attributes', 'status'])
+        self.assertEqual(
+            [row[:2] for row in rows[1:]],
+            [['a"b@x.com', 'Ann Lee'], ['c@x.com', 'Bob\nSmith, Jr'], ['d@x.com', 'Dee']]
+        )
+
+    def test_stray_quote_serial(self):
+        with mock.patch.object(csv_formatter, 'CHUNK_ROWS', 1):
+            self.assertEqual(csv_formatter.process_csv(self.input_file, self.output_file, workers=1), 3)
+
+        self.assert_stray_quote_output()
+
+    def test_stray_quote_parallel(self):
+        with mock.patch.object(csv_formatter, 'CHUNK_ROWS', 1), \
+             mock.patch.object(csv_formatter, 'PARALLEL_MIN_SIZE', 0):
+            self.assertEqual(csv_formatter.process_csv(self.input_file, self.output_file, workers=2), 3)
+
+        self.assert_stray_quote_output()
+
+if __name__ == '__main__':
+    unittest.main()
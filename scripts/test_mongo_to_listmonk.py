@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Tests for the incremental sync logic of the MongoDB to ListMonk integration.
+
+The user and tracking collections are replaced by a small in-memory fake
+that understands just the queries and updates the integration issues.
+
+Run with: python -m unittest test_mongo_to_listmonk
+"""
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+try:
+    import mongo_to_listmonk
+except ImportError:
+    # pymongo is not installed
+    mongo_to_listmonk = None
+
+T1 = datetime(2024, 1, 1, 10, 0, 0)
+T2 = datetime(2024, 1, 1, 11, 0, 0)
+T3 = datetime(2024, 1, 1, 12, 0, 0)
+
+def matches(doc, query):
+    """Tell whether a document matches a MongoDB query, for the operators used here."""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+            continue
+
+        value = doc.get(field)
+        if isinstance(condition, dict):
+            for op, operand in condition.items():
+                if op == "$gt":
+                    # Comparisons never match across null and other types
+                    if value is None or operand is None or not value > operand:
+                        return False
+                elif op == "$ne":
+                    if value == operand:
+                        return False
+                else:
+                    raise NotImplementedError(op)
+        elif value != condition:
+            # A null condition also matches a missing field
+            return False
+    return True
+
+class FakeCursor:
+    """Cursor over the documents matching a query, applied on iteration."""
+
+    def __init__(self, collection, query, projection, batch_size=None):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.sort_keys = None
+        self.limit_count = 0
+        self.hint_keys = None
+
+    def sort(self, keys):
+        self.sort_keys = keys
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def hint(self, keys):
+        self.hint_keys = keys
+        return self
+
+    def __iter__(self):
+        docs = [doc for doc in self.collection.docs.values() if matches(doc, self.query)]
+
+        # Null and missing values sort before everything else
+        for field, direction in reversed(self.sort_keys or []):
+            docs.sort(
+                key=lambda doc: (doc.get(field) is not None, doc.get(field) or 0),
+                reverse=direction < 0
+            )
+        if self.limit_count:
+            docs = docs[:self.limit_count]
+
+        for doc in docs:
+            yield {field: doc[field] for field in self.projection if field in doc}
+
+class FakeCollection:
+    """In-memory collection keyed by _id."""
+
+    def __init__(self, indexes=None):
+        self.docs = {}
+        self.indexes = indexes or {"_id_": {"key": [("_id", 1)]}}
+        self.cursors = []
+
+    def insert(self, *docs):
+        for doc in docs:
+            self.docs[doc["_id"]] = dict(doc)
+
+    def with_options(self, **options):
+        return self
+
+    def index_information(self):
+        return self.indexes
+
+    def find(self, query, projection, **kwargs):
+        cursor = FakeCursor(self, query, projection, **kwargs)
+        self.cursors.append(cursor)
+        return cursor
+
+    def find_one(self, query):
+        doc = self.docs.get(query["_id"])
+        return dict(doc) if doc else None
+
+    def update_one(self, query, update, upsert=False):
+        if query["_id"] not in self.docs:
+            if not upsert:
+                return
+            self.docs[query["_id"]] = {"_id": query["_id"]}
+
+        doc = self.docs[query["_id"]]
+        doc.update(update.get("$set", {}))
+        for field in update.get("$unset", {}):
+            doc.pop(field, None)
+
+@unittest.skipIf(mongo_to_listmonk is None, "pymongo is not installed")
+class IncrementalSyncTest(unittest.TestCase):
+    """Tests for resuming an export from the last sync position."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+        self.config = {
+            "mongo_uri": "mongodb://localhost:27017",
+            "mongo_db": "test",
+            "mongo_collection": "users",
+            "email_field": "email",
+            "name_field": "name",
+            "created_at_field": "createdAt",
+            "processed_csv_path": os.path.join(self.tmpdir.name, "listmonk_import.csv"),
+            "tracking_collection": "listmonk_sync",
+            "last_sync_key": "last_sync_timestamp"
+        }
+
+        self.users = FakeCollection(indexes={
+            "_id_": {"key": [("_id", 1)]},
+            "createdAt_1__id_1": {"key": [("createdAt", 1), ("_id", 1)]}
+        })
+        self.tracking = FakeCollection()
+        self.db = {"users": self.users, "listmonk_sync": self.tracking}
+
+    def make_integration(self, **config):
+        config_file = os.path.join(self.tmpdir.name, "config.json")
+        with open(config_file, 'w') as f:
+            json.dump(dict(self.config, **config), f)
+
+        mongo_to_listmonk.clear_config_cache()
+        return mongo_to_listmonk.MongoToListmonk(config_file)
+
+    def sync(self, integration):
+        """Run one extraction and confirm it, returning the exported emails."""
+        with contextlib.redirect_stdout(io.StringIO()):
+            count = integration.export_users(integration.extract_new_users(self.db))
+            if count:
+                integration.save_pending_sync_position(self.db)
+                integration.update_last_sync_timestamp(self.db)
+
+        with open(self.config["processed_csv_path"], 'r', encoding='utf-8') as f:
+            return [line.split(',', 1)[0] for line in f.read().splitlines()[1:]]
+
+    def tracking_doc(self):
+        return self.tracking.docs.get(self.config["last_sync_key"])
+
+    def test_first_sync_exports_everything(self):
+        self.users.insert(
+            {"_id": 2, "email": "b@x.com", "createdAt": T2},
+            {"_id": 1, "email": "a@x.com", "createdAt": T1}
+        )
+
+        self.assertEqual(self.sync(self.make_integration()), ["a@x.com", "b@x.com"])
+        self.assertEqual(self.users.cursors[0].query, {})
+        self.assertEqual(self.users.cursors[0].hint_keys, [("createdAt", 1), ("_id", 1)])
+
+    def test_shared_timestamp_across_batch_limit(self):
+        self.users.insert(
+            {"_id": 1, "email": "a@x.com", "createdAt": T1},
+            {"_id": 2, "email": "b@x.com", "createdAt": T2},
+            {"_id": 3, "email": "c@x.com", "createdAt": T2},
+            {"_id": 4, "email": "d@x.com", "createdAt": T2},
+            {"_id": 5, "email": "e@x.com", "createdAt": T3}
+        )
+        integration = self.make_integration(batch_limit=2)
+
+        # The first batch stops between users sharing T2
+        self.assertEqual(self.sync(integration), ["a@x.com", "b@x.com"])
+        self.assertEqual(
+            self.tracking_doc(),
+            {"_id": "last_sync_timestamp", "timestamp": T2, "last_id": 2}
+        )
+
+        self.assertEqual(self.sync(integration), ["c@x.com", "d@x.com"])
+        self.assertEqual(self.users.cursors[-1].query, {"$or": [
+            {"createdAt": {"$gt": T2}},
+            {"createdAt": T2, "_id": {"$gt": 2}}
+        ]})
+
+        self.assertEqual(self.sync(integration), ["e@x.com"])
+        self.assertEqual(self.sync(integration), [])
+        self.assertEqual(self.tracking_doc()["last_id"], 5)
+
+    def test_update_promotes_pending_position(self):
+        self.tracking.insert({
+            "_id": "last_sync_timestamp",
+            "timestamp": T1,
+            "last_id": 1,
+            "pending_timestamp": T2,
+            "pending_last_id": 7
+        })
+
+        self.make_integration().update_last_sync_timestamp(self.db)
+
+        self.assertEqual(
+            self.tracking_doc(),
+            {"_id": "last_sync_timestamp", "timestamp": T2, "last_id": 7}
+        )
+
+    def test_update_without_pending_position(self):
+        self.tracking.insert({"_id": "last_sync_timestamp", "timestamp": T1, "last_id": 1})
+
+        before = datetime.now(timezone.utc)
+        self.make_integration().update_last_sync_timestamp(self.db)
+
+        doc = self.tracking_doc()
+        self.assertNotIn("last_id", doc)
+        self.assertGreaterEqual(doc["timestamp"], before)
+
+    def test_legacy_timestamp_only(self):
+        self.tracking.insert({"_id": "last_sync_timestamp", "timestamp": T1})
+        self.users.insert(
+            {"_id": 1, "email": "a@x.com", "createdAt": T1},
+            {"_id": 2, "email": "b@x.com", "createdAt": T2}
+        )
+
+        self.assertEqual(self.sync(self.make_integration()), ["b@x.com"])
+        self.assertEqual(self.users.cursors[0].query, {"createdAt": {"$gt": T1}})
+        self.assertEqual(
+            self.tracking_doc(),
+            {"_id": "last_sync_timestamp", "timestamp": T2, "last_id": 2}
+        )
+
+    def test_position_without_timestamp(self):
+        # Users without a createdAt sort first; the last sync stopped
+        # among them
+        self.tracking.insert({"_id": "last_sync_timestamp", "timestamp": None, "last_id": 1})
+        self.users.insert(
+            {"_id": 1, "email": "a@x.com"},
+            {"_id": 2, "email": "b@x.com", "createdAt": None},
+            {"_id": 3, "email": "c@x.com", "createdAt": T1}
+        )
+
+        self.assertEqual(self.sync(self.make_integration()), ["b@x.com", "c@x.com"])
+        self.assertEqual(self.users.cursors[0].query, {"$or": [
+            {"createdAt": {"$ne": None}},
+            {"createdAt": None, "_id": {"$gt": 1}}
+        ]})
+
+if __name__ == '__main__':
+    unittest.main()